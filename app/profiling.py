@@ -0,0 +1,209 @@
+import cProfile
+import hmac
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Mapping, Optional, Set, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Profiling is only controllable (header or admin endpoint) when a token is set
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")
+# Each profile is three files; the oldest are deleted beyond this many
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "300"))
+
+PROFILE_HEADER = "x-profile"
+REQUEST_ID_HEADER = "x-request-id"
+
+_PROFILE_SUFFIXES = (".prof", ".folded", ".json")
+
+_Func = Tuple[str, int, str]
+
+
+def _clamp_rate(value: float) -> float:
+    return min(1.0, max(0.0, float(value)))
+
+
+_SAMPLE_RATE: float = _clamp_rate(float(os.getenv("PROFILE_SAMPLE_RATE", "0") or 0))
+
+
+def set_sample_rate(value: float) -> None:
+    global _SAMPLE_RATE
+    _SAMPLE_RATE = _clamp_rate(value)
+
+
+def get_sample_rate() -> float:
+    return _SAMPLE_RATE
+
+
+def is_admin(token: Optional[str]) -> bool:
+    if not PROFILE_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+class RequestProfiler:
+    """
+    Per-request cProfile wrapper. The profiler only runs inside section(),
+    which callers must never hold across an await or yield, so other requests
+    on the event loop don't leak into this profile. On Python 3.12+ cProfile
+    records every thread while enabled, so threadpool work running at the
+    same time (e.g. another profile's finish()) can still show up.
+    finish() does file I/O and should run off the event loop (e.g. as a
+    background task).
+    """
+
+    def __init__(self, request_id: str, endpoint: str, enabled: bool) -> None:
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.tool_calls = 0
+        self.input_text: Optional[str] = ""
+        self._profile: Optional[cProfile.Profile] = cProfile.Profile() if enabled else None
+        self._enable_failed = False
+        self._started = time.time()
+        self._wall_start = time.perf_counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self._profile is not None
+
+    @contextmanager
+    def section(self) -> Iterator[None]:
+        if self._profile is None:
+            yield
+            return
+        try:
+            self._profile.enable()
+        except Exception:
+            # e.g. Python 3.12+ refuses while another profiler is active;
+            # run this section unprofiled rather than failing the request
+            if not self._enable_failed:
+                logger.warning(f"Could not enable profiler for request {self.request_id}", exc_info=True)
+                self._enable_failed = True
+            yield
+            return
+        try:
+            yield
+        finally:
+            self._profile.disable()
+
+    def finish(self) -> Optional[str]:
+        """Write <base>.prof, <base>.folded and <base>.json; returns <base> or None."""
+        if self._profile is None:
+            return None
+        profile, self._profile = self._profile, None
+
+        # Never let a profiling failure surface in the request being profiled
+        try:
+            return self._write(profile)
+        except Exception:
+            logger.exception(f"Failed to write profile for request {self.request_id}")
+            return None
+
+    def _write(self, profile: cProfile.Profile) -> str:
+        # The client-supplied request id only goes in the metadata, so
+        # repeated ids can't overwrite each other's files
+        base = os.path.join(
+            PROFILE_DIR, f"{int(self._started * 1000)}-{self.endpoint}-{uuid.uuid4().hex[:12]}"
+        )
+        profile.create_stats()
+        stats: Dict[_Func, tuple] = profile.stats  # type: ignore[attr-defined]
+        meta = {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "started": self._started,
+            "wall_seconds": time.perf_counter() - self._wall_start,
+            "profiled_seconds": sum(s[2] for s in stats.values()),
+            "input_bytes": len((self.input_text or "").encode("utf-8")),
+            "tool_calls": self.tool_calls,
+        }
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile.dump_stats(base + ".prof")
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            root = f"{self.endpoint} {self.request_id}".replace(";", "_")
+            f.writelines(f"{line}\n" for line in _folded_stacks(stats, root))
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        _prune_profiles()
+
+        logger.info(f"Wrote profile {base} ({meta['input_bytes']} bytes, {self.tool_calls} tool calls)")
+        return base
+
+
+def _prune_profiles() -> None:
+    """Delete the oldest profile files once PROFILE_DIR holds more than PROFILE_MAX_FILES."""
+    # Names start with the millisecond start time, so name order is age order
+    # and a profile's three files sort next to each other
+    entries = sorted(
+        (entry.name, entry.path) for entry in os.scandir(PROFILE_DIR)
+        if entry.is_file() and entry.name.endswith(_PROFILE_SUFFIXES)
+    )
+    excess = len(entries) - PROFILE_MAX_FILES
+    if excess <= 0:
+        return
+    for _, path in entries[:excess]:
+        try:
+            os.remove(path)
+        except OSError:
+            # Another worker may have pruned it already
+            pass
+
+
+def start_request_profile(headers: Mapping[str, str], endpoint: str) -> RequestProfiler:
+    """Profile when the admin header is present, otherwise at the configured sample rate."""
+    request_id = headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    enabled = is_admin(headers.get(PROFILE_HEADER)) or random.random() < _SAMPLE_RATE
+    return RequestProfiler(request_id, endpoint, enabled)
+
+
+def _frame_label(func: _Func) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        label = name
+    else:
+        label = f"{name} ({os.path.basename(filename)}:{lineno})"
+    return label.replace(";", "_")
+
+
+def _folded_stacks(stats: Dict[_Func, tuple], root: str) -> List[str]:
+    """
+    Rebuild collapsed stacks ("a;b;c <microseconds>") from cProfile's
+    caller/callee graph for flamegraph.pl or speedscope. cProfile only keeps
+    one level of call edges, so time is split across callers proportionally.
+    """
+    callees: Dict[_Func, Dict[_Func, float]] = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+
+    folded: Dict[str, int] = defaultdict(int)
+    on_stack: Set[_Func] = set()
+
+    def walk(func: _Func, path: str, budget: float) -> None:
+        _, _, tt, ct, _ = stats[func]
+        # Sub-microsecond branches can't show up in the output anyway
+        if ct <= 0 or budget < 1e-6:
+            return
+        scale = min(1.0, budget / ct)
+        frames = f"{path};{_frame_label(func)}"
+        self_us = int(tt * scale * 1e6)
+        if self_us:
+            folded[frames] += self_us
+        on_stack.add(func)
+        for callee, edge_ct in callees.get(func, {}).items():
+            if callee not in on_stack and callee in stats:
+                walk(callee, frames, edge_ct * scale)
+        on_stack.discard(func)
+
+    for func, (_, _, _, ct, callers) in stats.items():
+        if not callers:
+            walk(func, root, ct)
+
+    return [f"{stack} {us}" for stack, us in folded.items()]
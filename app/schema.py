@@ -84,4 +84,8 @@ class CompletionResponse(BaseModel):
     created: int
     model: str
     choices: List[CompletionChoice]
-    usage: UsageStats
\ No newline at end of file
+    usage: UsageStats
+
+
+class ProfilingConfig(BaseModel):
+    sample_rate: float
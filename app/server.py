@@ -1,13 +1,15 @@
 import json
 import logging
 import time
-from fastapi import FastAPI
+from fastapi import BackgroundTasks, FastAPI, Header, Request
 from fastapi.responses import JSONResponse, StreamingResponse
-from typing import List, Optional, Set
+from starlette.background import BackgroundTask
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.profiling import PROFILE_DIR, get_sample_rate, is_admin, set_sample_rate, start_request_profile
 from app.state import clear_edits, has_edits, pop_edit, set_in_flight
 from app.streaming_parser import QwenStreamingParser
 from app.translator import translate_xml_to_openai
-from app.schema import AssistantMessage, ChatCompletionRequest, ChatCompletionResponse, Choice, CompletionChoice, CompletionRequest, CompletionResponse, FunctionCall, ToolCall, TranslatedResponse, TranslationRequest, UsageStats
+from app.schema import AssistantMessage, ChatCompletionRequest, ChatCompletionResponse, Choice, CompletionChoice, CompletionRequest, CompletionResponse, FunctionCall, ProfilingConfig, ToolCall, TranslatedResponse, TranslationRequest, UsageStats
 from dotenv import load_dotenv
 import httpx
 import os
@@ -39,6 +41,23 @@ async def health():
     return {"status": "ok"}
 
 
+# ----- Profiling admin -----
+
+@app.get("/admin/profiling")
+async def get_profiling(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin(x_admin_token):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return {"sample_rate": get_sample_rate(), "profile_dir": PROFILE_DIR}
+
+@app.post("/admin/profiling")
+async def configure_profiling(config: ProfilingConfig, x_admin_token: Optional[str] = Header(None)):
+    if not is_admin(x_admin_token):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    set_sample_rate(config.sample_rate)
+    logger.info(f"Profiling sample rate set to {get_sample_rate()}")
+    return {"sample_rate": get_sample_rate(), "profile_dir": PROFILE_DIR}
+
+
 # ----- OpenAI-compatible endpoint -----
 
 @app.post("/v1/completions")
@@ -102,13 +121,13 @@ async def legacy_completions(request: CompletionRequest):
 
 
 @app.post("/v1/chat/completions", response_model=ChatCompletionResponse)
-async def openai_compatible(request: ChatCompletionRequest):
+async def openai_compatible(request: ChatCompletionRequest, http_request: Request, background_tasks: BackgroundTasks):
     logger.debug(f"Request stream: {request.stream}")
     
     request_payload = request.model_dump(exclude_none=True)
 
     if request.stream:
-        return await stream_chat(request)
+        return await _stream_chat_response(request, http_request, "openai_compatible")
 
     async with httpx.AsyncClient(timeout=60.0) as client:
         openrouter_response = await client.post(
@@ -128,6 +147,19 @@ async def openai_compatible(request: ChatCompletionRequest):
             "body": openrouter_response.text,
         }
 
+    profiler = start_request_profile(http_request.headers, "openai_compatible")
+    with profiler.section():
+        final_payload, raw_response, profiler.tool_calls = _build_chat_response(request, openrouter_response)
+    if profiler.enabled:
+        profiler.input_text = raw_response
+        background_tasks.add_task(profiler.finish)
+    return final_payload
+
+
+def _build_chat_response(
+    request: ChatCompletionRequest, openrouter_response: httpx.Response
+) -> Tuple[Dict[str, Any], Optional[str], int]:
+    """Translate an upstream completion into the OpenAI response payload."""
     raw_data = openrouter_response.json()
     logger.debug(f"Raw data from OpenRouter: {raw_data}")
     raw_response = raw_data["choices"][0]["message"]["content"]
@@ -184,11 +216,16 @@ async def openai_compatible(request: ChatCompletionRequest):
     final_payload = response_payload.model_dump(exclude_none=True)
     logger.debug(f"Final response payload: {final_payload}")
     logger.debug("Final tool calls: %s", tool_calls_list)
-    return final_payload
+    return final_payload, raw_response, len(tool_calls_list or [])
 
 
 @app.post("/v1/chat/completions/stream")
-async def stream_chat(request: ChatCompletionRequest):
+async def stream_chat(request: ChatCompletionRequest, http_request: Request):
+    return await _stream_chat_response(request, http_request, "stream_chat")
+
+
+async def _stream_chat_response(request: ChatCompletionRequest, http_request: Request, endpoint: str):
+    """Shared streaming implementation; endpoint names the route profiles are tagged with."""
     if not request.stream:
         raise ValueError("Set stream=true to use this endpoint.")
 
@@ -201,56 +238,69 @@ async def stream_chat(request: ChatCompletionRequest):
     
     preferred: Set[str] = {t["function"]["name"] for t in (request.tools or []) if t.get("type") == "function"}
     parser = QwenStreamingParser(preferred_names=preferred)
+    profiler = start_request_profile(http_request.headers, endpoint)
 
     async def event_stream():
         accumulated = ""
         previous = ""
 
-        async with httpx.AsyncClient(timeout=None) as client:
-            async with client.stream(
-                "POST",
-                f"{QWEN_BASE_URL}/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json=request.model_dump(exclude_none=True),
-            ) as response:
-                async for line in response.aiter_lines():
-                    if not line.startswith("data: "):
-                        continue
-
-                    if line.strip() == "data: [DONE]":
-                        logger.info("Received [DONE] from upstream.")
-                        yield "data: [DONE]\n\n"
-                        break
-
-                    try:
-                        payload = json.loads(line[6:])
-                        delta_text = payload["choices"][0]["delta"].get("content", "")
-                        # logger.debug(f"Delta text received: {delta_text!r}")
-
-                        current = accumulated + delta_text
-                        delta = parser.extract_stream_delta(previous, current, delta_text)
-
-                        if delta:
-                            # logger.debug(f"Tool call delta emitted: {json.dumps(delta)}")
-                            chunk = {
-                                "id": payload.get("id", "stream-id"),
-                                "object": "chat.completion.chunk",
-                                "created": payload.get("created", 0),
-                                "model": request.model,
-                                "choices": [{
-                                    "index": 0,
-                                    "delta": delta,
-                                    "finish_reason": None
-                                }]
-                            }
-                            yield f"data: {json.dumps(chunk)}\n\n"
-
-                        previous = current
-                        accumulated = current
-
-                    except Exception:
-                        logger.exception("Error processing stream chunk")
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
\ No newline at end of file
+        try:
+            async with httpx.AsyncClient(timeout=None) as client:
+                async with client.stream(
+                    "POST",
+                    f"{QWEN_BASE_URL}/v1/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {API_KEY}",
+                        "Content-Type": "application/json",
+                    },
+                    json=request.model_dump(exclude_none=True),
+                ) as response:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: "):
+                            continue
+
+                        if line.strip() == "data: [DONE]":
+                            logger.info("Received [DONE] from upstream.")
+                            yield "data: [DONE]\n\n"
+                            break
+
+                        try:
+                            # Only the synchronous work is profiled; never yield inside the section
+                            out = None
+                            with profiler.section():
+                                payload = json.loads(line[6:])
+                                delta_text = payload["choices"][0]["delta"].get("content", "")
+                                # logger.debug(f"Delta text received: {delta_text!r}")
+
+                                current = accumulated + delta_text
+                                delta = parser.extract_stream_delta(previous, current, delta_text)
+
+                                if delta:
+                                    # logger.debug(f"Tool call delta emitted: {json.dumps(delta)}")
+                                    profiler.tool_calls += len(delta.get("tool_calls", []))
+                                    chunk = {
+                                        "id": payload.get("id", "stream-id"),
+                                        "object": "chat.completion.chunk",
+                                        "created": payload.get("created", 0),
+                                        "model": request.model,
+                                        "choices": [{
+                                            "index": 0,
+                                            "delta": delta,
+                                            "finish_reason": None
+                                        }]
+                                    }
+                                    out = f"data: {json.dumps(chunk)}\n\n"
+
+                                previous = current
+                                accumulated = current
+
+                            if out:
+                                yield out
+
+                        except Exception:
+                            logger.exception("Error processing stream chunk")
+        finally:
+            profiler.input_text = accumulated
+    # The profile is post-processed and written in the threadpool once the stream has been sent
+    background = BackgroundTask(profiler.finish) if profiler.enabled else None
+    return StreamingResponse(event_stream(), media_type="text/event-stream", background=background)
\ No newline at end of file
@@ -0,0 +1,284 @@
+"""
+Parser microbenchmarks.
+
+Times translate_xml_to_openai, parse_tool_call_block and
+QwenStreamingParser.extract_stream_delta on well-formed and adversarial inputs
+at doubling sizes, reports throughput and the log-log growth slope of each
+series, and flags anything that grows faster than linearly.
+
+Run from the repo root:
+    python -m bench.parser_bench
+    python -m bench.parser_bench --save bench_baseline.json
+    python -m bench.parser_bench --compare bench_baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# app/__init__.py configures logging from LOG_LEVEL; keep DEBUG output of
+# megabyte-sized blocks out of the measurements.
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app.parser import parse_tool_call_block
+from app.streaming_parser import QwenStreamingParser
+from app.translator import translate_xml_to_openai
+
+
+# ----- Input generators -----
+# Each takes a target size in bytes and returns text of roughly that size.
+
+def _repeat(unit: str, size: int) -> str:
+    return unit * max(1, size // len(unit))
+
+
+def _xml_many_calls(size: int) -> str:
+    unit = "<tool_call><function=read_file><parameter=filepath>src/app.py</parameter><parameter=limit>10</parameter></function></tool_call>\n"
+    return "Reading files\n" + _repeat(unit, size)
+
+
+def _xml_big_value(size: int) -> str:
+    return f"<tool_call><function=write_file><parameter=filepath>a.txt</parameter><parameter=content>{_repeat('x', size)}</parameter></function></tool_call>"
+
+
+def _xml_unterminated(size: int) -> str:
+    # Every <tool_call> opener scans to the end of input looking for a close
+    return _repeat("<tool_call>x", size)
+
+
+def _block_many_params(size: int) -> str:
+    return "<function=f>" + _repeat("<parameter=a>value</parameter>", size) + "</function>"
+
+
+def _block_big_value(size: int) -> str:
+    return f"<function=f><parameter=content>{_repeat('x', size)}</parameter></function>"
+
+
+def _block_unclosed_params(size: int) -> str:
+    return "<function=f>" + _repeat("<parameter=a>v", size) + "</function>"
+
+
+def _fence_many_args(size: int) -> str:
+    return "```tool\nTOOL_NAME: read_file\n" + _repeat("BEGIN_ARG: a\nvalue\nEND_ARG\n", size) + "```\n"
+
+
+def _fence_big_value(size: int) -> str:
+    return f"```tool\nTOOL_NAME: read_file\nBEGIN_ARG: content\n{_repeat('x' * 79 + chr(10), size)}END_ARG\n```\n"
+
+
+def _fence_unterminated(size: int) -> str:
+    return "```tool\nTOOL_NAME: read_file\n" + _repeat("BEGIN_ARG: a\nvalue\nEND_ARG\n", size)
+
+
+def _feed_stream(text: str, chunk: int) -> None:
+    """Replay text through a fresh parser the same way server.stream_chat does."""
+    parser = QwenStreamingParser()
+    accumulated = ""
+    for i in range(0, len(text), chunk):
+        delta_text = text[i:i + chunk]
+        current = accumulated + delta_text
+        parser.extract_stream_delta(accumulated, current, delta_text)
+        accumulated = current
+
+
+# (series name, kind, generator); kind selects the entry point under test
+CASES: List[Tuple[str, str, Callable[[int], str]]] = [
+    ("translate/many_calls", "translate", _xml_many_calls),
+    ("translate/big_value", "translate", _xml_big_value),
+    ("translate/unterminated", "translate", _xml_unterminated),
+    ("block/many_params", "block", _block_many_params),
+    ("block/big_value", "block", _block_big_value),
+    ("block/unclosed_params", "block", _block_unclosed_params),
+    ("stream/many_args", "stream", _fence_many_args),
+    ("stream/big_value", "stream", _fence_big_value),
+    ("stream/unterminated", "stream", _fence_unterminated),
+]
+
+
+# ----- Measurement -----
+
+def _best_time(fn: Callable[[], Any], repeat: int, budget: float) -> float:
+    best = math.inf
+    spent = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent >= budget:
+            break
+    return best
+
+
+def _slope(points: List[Tuple[int, float]]) -> Optional[float]:
+    """Least-squares slope of log(seconds) against log(bytes); ~1 is linear, ~2 quadratic."""
+    # Sub-100us timings are mostly noise and flatten the curve
+    usable = [(b, t) for b, t in points if t >= 1e-4]
+    if len(usable) < 2:
+        return None
+    xs = [math.log(b) for b, _ in usable]
+    ys = [math.log(t) for _, t in usable]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    denom = sum((x - mx) ** 2 for x in xs)
+    if denom == 0:
+        return None
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / denom
+
+
+def _sizes(min_bytes: int, max_bytes: int) -> List[int]:
+    sizes = []
+    size = min_bytes
+    while size <= max_bytes:
+        sizes.append(size)
+        size *= 2
+    return sizes
+
+
+def run_series(fn: Callable[[str], Any], make: Callable[[int], str], sizes: List[int],
+               repeat: int, max_seconds: float) -> Dict[str, Any]:
+    points: List[Tuple[int, float]] = []
+    truncated = False
+    for size in sizes:
+        # Predict the next run from the growth seen so far and stop before a
+        # quadratic case runs away with the whole session.
+        if points:
+            last_bytes, last_t = points[-1]
+            exponent = max(1.0, _slope(points) or 1.0)
+            if last_t * (size / last_bytes) ** exponent > max_seconds:
+                truncated = True
+                break
+        text = make(size)
+        elapsed = _best_time(lambda: fn(text), repeat, max_seconds)
+        points.append((len(text.encode("utf-8")), elapsed))
+    return {"points": points, "slope": _slope(points), "truncated": truncated}
+
+
+def run_all(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    oneshot_sizes = _sizes(args.min_bytes, args.max_bytes)
+    stream_sizes = _sizes(args.stream_min_bytes, args.stream_max_bytes)
+
+    for name, kind, make in CASES:
+        if kind == "stream":
+            for chunk in args.chunks:
+                series = f"{name}@{chunk}"
+                if args.filter and args.filter not in series:
+                    continue
+                results[series] = run_series(
+                    lambda text, c=chunk: _feed_stream(text, c),
+                    make, stream_sizes, args.repeat, args.max_seconds,
+                )
+                _print_series(series, results[series], args.slope_threshold)
+            continue
+
+        if args.filter and args.filter not in name:
+            continue
+        fn = translate_xml_to_openai if kind == "translate" else parse_tool_call_block
+        results[name] = run_series(fn, make, oneshot_sizes, args.repeat, args.max_seconds)
+        _print_series(name, results[name], args.slope_threshold)
+    return results
+
+
+# ----- Reporting -----
+
+def _print_series(name: str, result: Dict[str, Any], threshold: float) -> None:
+    print(name)
+    print(f"  {'bytes':>10}  {'seconds':>10}  {'MB/s':>9}")
+    for size, seconds in result["points"]:
+        mbps = size / seconds / 1e6 if seconds > 0 else math.inf
+        print(f"  {size:>10}  {seconds:>10.6f}  {mbps:>9.2f}")
+    slope = result["slope"]
+    if slope is None:
+        verdict = "slope n/a (too fast to measure)"
+    else:
+        verdict = f"slope {slope:.2f}" + ("  SUPER-LINEAR" if slope > threshold else "")
+    if result["truncated"]:
+        verdict += "  (stopped early, next size over budget)"
+    print(f"  {verdict}\n")
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return the series that got slower than baseline by more than tolerance."""
+    regressions: List[str] = []
+    print("Comparison against baseline")
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"  {name}: no baseline")
+            continue
+        base_times = {size: seconds for size, seconds in base["points"]}
+        ratios = [seconds / base_times[size] for size, seconds in result["points"]
+                  if base_times.get(size)]
+        if not ratios:
+            print(f"  {name}: no overlapping sizes")
+            continue
+        worst = max(ratios)
+        flag = worst > 1 + tolerance
+        if flag:
+            regressions.append(name)
+        print(f"  {name}: worst {worst:.2f}x baseline" + ("  REGRESSION" if flag else ""))
+    print()
+    return regressions
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Parser throughput and scaling benchmarks")
+    p.add_argument("--filter", help="only run series whose name contains this substring")
+    p.add_argument("--min-bytes", type=int, default=16 * 1024)
+    p.add_argument("--max-bytes", type=int, default=4 * 1024 * 1024)
+    p.add_argument("--stream-min-bytes", type=int, default=2 * 1024)
+    p.add_argument("--stream-max-bytes", type=int, default=128 * 1024)
+    p.add_argument("--chunks", type=int, nargs="+", default=[1, 16, 256],
+                   help="stream chunk sizes in characters")
+    p.add_argument("--repeat", type=int, default=3, help="runs per point; the best is kept")
+    p.add_argument("--max-seconds", type=float, default=2.0,
+                   help="time budget for a single point; larger sizes are skipped once exceeded")
+    p.add_argument("--slope-threshold", type=float, default=1.3,
+                   help="log-log slope above which a series is flagged super-linear")
+    p.add_argument("--save", help="write results to this JSON file")
+    p.add_argument("--compare", help="compare against a JSON file written by --save")
+    p.add_argument("--tolerance", type=float, default=0.25,
+                   help="allowed slowdown against baseline before flagging (0.25 = 25%%)")
+    p.add_argument("--strict", action="store_true",
+                   help="exit non-zero on super-linear series or baseline regressions")
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    results = run_all(args)
+
+    superlinear = [name for name, r in results.items()
+                   if r["slope"] is not None and r["slope"] > args.slope_threshold]
+    regressions: List[str] = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "created": int(time.time()),
+                "results": results,
+            }, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if superlinear:
+        print("Super-linear series: " + ", ".join(superlinear))
+    if regressions:
+        print("Regressed series: " + ", ".join(regressions))
+    if args.strict and (superlinear or regressions):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
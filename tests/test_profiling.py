@@ -0,0 +1,272 @@
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import profiling, server
+from app.profiling import RequestProfiler
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _fib(n: int) -> int:
+    return n if n < 2 else _fib(n - 1) + _fib(n - 2)
+
+
+def _work() -> int:
+    return sum(len(json.dumps({"n": _fib(i)})) for i in range(18))
+
+
+def _profile_files(path):
+    return sorted(p for p in os.listdir(path) if p.endswith(profiling._PROFILE_SUFFIXES))
+
+
+@pytest.mark.parametrize("input_text", [None, ""])
+def test_finish_with_empty_input(profile_dir, input_text):
+    profiler = RequestProfiler("req-1", "openai_compatible", enabled=True)
+    with profiler.section():
+        _work()
+    profiler.input_text = input_text
+
+    base = profiler.finish()
+
+    assert base is not None
+    with open(base + ".json", encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["request_id"] == "req-1"
+    assert meta["input_bytes"] == 0
+
+
+def test_finish_disabled_writes_nothing(profile_dir):
+    profiler = RequestProfiler("req-1", "stream_chat", enabled=False)
+    with profiler.section():
+        _work()
+
+    assert profiler.finish() is None
+    assert _profile_files(profile_dir) == []
+
+
+def test_finish_swallows_errors(profile_dir, monkeypatch):
+    def boom(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(profiling, "_folded_stacks", boom)
+    profiler = RequestProfiler("req-1", "stream_chat", enabled=True)
+    with profiler.section():
+        _work()
+
+    assert profiler.finish() is None
+
+
+def test_folded_total_matches_profiled_seconds(profile_dir):
+    profiler = RequestProfiler("req-1", "stream_chat", enabled=True)
+    for _ in range(3):
+        with profiler.section():
+            _work()
+
+    base = profiler.finish()
+
+    with open(base + ".json", encoding="utf-8") as f:
+        profiled_us = json.load(f)["profiled_seconds"] * 1e6
+    with open(base + ".folded", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert all(line.startswith("stream_chat req-1;") for line in lines)
+    folded_us = sum(int(line.rsplit(" ", 1)[1]) for line in lines)
+    # Truncation to whole microseconds and the sub-microsecond cutoff lose a little
+    assert folded_us == pytest.approx(profiled_us, rel=0.1)
+
+
+class _FailingProfile:
+    def enable(self):
+        raise ValueError("Another profiling tool is already active")
+
+    def disable(self):
+        raise AssertionError("disable() called without a successful enable()")
+
+
+def test_section_runs_unprofiled_when_enable_fails(profile_dir):
+    profiler = RequestProfiler("req-1", "stream_chat", enabled=True)
+    profiler._profile = _FailingProfile()
+
+    for _ in range(2):
+        with profiler.section():
+            result = _work()
+    assert result > 0
+
+    with pytest.raises(KeyError):
+        with profiler.section():
+            raise KeyError("body errors still propagate")
+
+
+def test_same_request_id_does_not_overwrite(profile_dir):
+    bases = []
+    for _ in range(2):
+        profiler = RequestProfiler("same-id", "stream_chat", enabled=True)
+        with profiler.section():
+            _work()
+        bases.append(profiler.finish())
+
+    assert bases[0] != bases[1]
+    assert len(_profile_files(profile_dir)) == 6
+
+
+def test_prune_keeps_newest_files(profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MAX_FILES", 6)
+    bases = []
+    for i in range(4):
+        profiler = RequestProfiler(f"req-{i}", "stream_chat", enabled=True)
+        profiler._started += i  # distinct, increasing name prefixes
+        with profiler.section():
+            _work()
+        bases.append(profiler.finish())
+
+    remaining = _profile_files(profile_dir)
+    assert len(remaining) == 6
+    assert {os.path.join(str(profile_dir), name) for name in remaining} == {
+        base + suffix for base in bases[2:] for suffix in profiling._PROFILE_SUFFIXES
+    }
+
+
+class _FakeUpstreamResponse:
+    is_success = True
+    status_code = 200
+    text = ""
+
+    def json(self):
+        return {
+            "id": "gen-1",
+            "created": 0,
+            "choices": [{"message": {"role": "assistant", "content": None}}],
+        }
+
+
+_STREAM_DELTAS = [
+    "Reading it now\n",
+    "```tool\nTOOL_NAME: read_file\n",
+    "BEGIN_ARG: filepath\nsrc/app.py\nEND_ARG\n",
+    "```\n",
+    "done",
+]
+
+
+class _FakeUpstreamStream:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def aiter_lines(self):
+        for i, text in enumerate(_STREAM_DELTAS):
+            yield "data: " + json.dumps({"id": f"gen-{i}", "created": 0, "choices": [{"delta": {"content": text}}]})
+        yield "data: [DONE]"
+
+
+class _FakeAsyncClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def stream(self, *args, **kwargs):
+        return _FakeUpstreamStream()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def post(self, *args, **kwargs):
+        return _FakeUpstreamResponse()
+
+
+def test_profiled_request_with_null_content(profile_dir, monkeypatch):
+    monkeypatch.setattr(server.httpx, "AsyncClient", _FakeAsyncClient)
+    monkeypatch.setattr(profiling, "PROFILE_ADMIN_TOKEN", "secret")
+    client = TestClient(server.app)
+    body = {"model": "qwen", "messages": [{"role": "user", "content": "hi"}]}
+
+    plain = client.post("/v1/chat/completions", json=body)
+    profiled = client.post(
+        "/v1/chat/completions", json=body, headers={"X-Profile": "secret", "X-Request-Id": "abc"}
+    )
+
+    assert plain.status_code == profiled.status_code == 200
+    assert profiled.json() == plain.json()
+    [meta_file] = [p for p in _profile_files(profile_dir) if p.endswith(".json")]
+    with open(os.path.join(str(profile_dir), meta_file), encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["request_id"] == "abc"
+    assert meta["input_bytes"] == 0
+    assert meta["tool_calls"] == 0
+
+
+def _read_only_meta(path):
+    [meta_file] = [p for p in _profile_files(path) if p.endswith(".json")]
+    with open(os.path.join(str(path), meta_file), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("route,endpoint", [
+    ("/v1/chat/completions/stream", "stream_chat"),
+    ("/v1/chat/completions", "openai_compatible"),
+])
+def test_profiled_stream_matches_unprofiled(profile_dir, monkeypatch, route, endpoint):
+    monkeypatch.setattr(server.httpx, "AsyncClient", _FakeAsyncClient)
+    monkeypatch.setattr(profiling, "PROFILE_ADMIN_TOKEN", "secret")
+    client = TestClient(server.app)
+    body = {"model": "qwen", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+
+    plain = client.post(route, json=body)
+    assert _profile_files(profile_dir) == []
+    profiled = client.post(route, json=body, headers={"X-Profile": "secret", "X-Request-Id": "abc"})
+
+    assert plain.status_code == profiled.status_code == 200
+    assert profiled.text == plain.text
+    assert '"tool_calls"' in profiled.text
+    assert profiled.text.endswith("data: [DONE]\n\n")
+    meta = _read_only_meta(profile_dir)
+    assert meta["request_id"] == "abc"
+    assert meta["endpoint"] == endpoint
+    assert meta["input_bytes"] == len("".join(_STREAM_DELTAS).encode("utf-8"))
+    assert meta["tool_calls"] == 1
+
+
+@pytest.fixture
+def admin_client(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "_SAMPLE_RATE", 0.0)
+    return TestClient(server.app)
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "wrong"}])
+def test_admin_profiling_rejects_bad_token(admin_client, headers):
+    assert admin_client.get("/admin/profiling", headers=headers).status_code == 403
+    resp = admin_client.post("/admin/profiling", json={"sample_rate": 0.5}, headers=headers)
+    assert resp.status_code == 403
+    assert profiling.get_sample_rate() == 0.0
+
+
+def test_admin_profiling_disabled_without_configured_token(admin_client, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_ADMIN_TOKEN", None)
+    headers = {"X-Admin-Token": "secret"}
+
+    assert admin_client.get("/admin/profiling", headers=headers).status_code == 403
+    resp = admin_client.post("/admin/profiling", json={"sample_rate": 0.5}, headers=headers)
+    assert resp.status_code == 403
+    assert profiling.get_sample_rate() == 0.0
+
+
+@pytest.mark.parametrize("requested,expected", [(5, 1.0), (-1, 0.0), (0.25, 0.25)])
+def test_admin_profiling_clamps_rate(admin_client, requested, expected):
+    headers = {"X-Admin-Token": "secret"}
+
+    resp = admin_client.post("/admin/profiling", json={"sample_rate": requested}, headers=headers)
+
+    assert resp.status_code == 200
+    assert resp.json()["sample_rate"] == expected
+    assert admin_client.get("/admin/profiling", headers=headers).json()["sample_rate"] == expected